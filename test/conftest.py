@@ -57,11 +57,21 @@ def _wrap_future(f: ResponseFuture) -> asyncio.Future:
     loop = asyncio.get_event_loop()
     aio_future = loop.create_future()
 
+    # The asyncio future may have been cancelled (e.g., by a task group
+    # whose other task failed) before the driver completes the request.
+    def set_result(result):
+        if not aio_future.done():
+            aio_future.set_result(result)
+
+    def set_exception(exception):
+        if not aio_future.done():
+            aio_future.set_exception(exception)
+
     def on_result(result):
-        loop.call_soon_threadsafe(aio_future.set_result, result)
+        loop.call_soon_threadsafe(set_result, result)
 
     def on_error(exception, *_):
-        loop.call_soon_threadsafe(aio_future.set_exception, exception)
+        loop.call_soon_threadsafe(set_exception, exception)
 
     f.add_callback(on_result)
     f.add_errback(on_error)
@@ -10,11 +10,17 @@
 # and automatically setting up the fixtures they need.
 
 import pytest
+import os
+import json
+import re
+from types import SimpleNamespace
+from dataclasses import dataclass
 
+from cassandra import OperationTimedOut
 from cassandra.auth import PlainTextAuthProvider
-from cassandra.cluster import Cluster, ConsistencyLevel, ExecutionProfile, EXEC_PROFILE_DEFAULT
-from cassandra.policies import RoundRobinPolicy
-from cassandra.connection import DRIVER_NAME, DRIVER_VERSION
+from cassandra.cluster import Cluster, ConsistencyLevel, ExecutionProfile, EXEC_PROFILE_DEFAULT, NoHostAvailable
+from cassandra.policies import RoundRobinPolicy, TokenAwarePolicy
+from cassandra.connection import DRIVER_NAME, DRIVER_VERSION, ConnectionException
 import ssl
 
 from util import unique_name, new_test_table
@@ -30,14 +36,29 @@ def pytest_addoption(parser):
     parser.addoption('--ssl', action='store_true',
         help='Connect to CQL via an encrypted TLSv1.2 connection')
 
+# "cql_opts" fixture: the command line options which determine how the
+# "cql" fixture connects to the server, read once and converted as needed.
+@pytest.fixture(scope="session")
+def cql_opts(request):
+    return SimpleNamespace(
+        host=request.config.getoption('host'),
+        port=int(request.config.getoption('port')),
+        ssl=request.config.getoption('ssl'))
+
 # "cql" fixture: set up client object for communicating with the CQL API.
 # The host/port combination of the server are determined by the --host and
 # --port options, and defaults to localhost and 9042, respectively.
 # We use scope="session" so that all tests will reuse the same client object.
 @pytest.fixture(scope="session")
-def cql(request):
+def cql(cql_opts):
+    # Request settings are given in execution profiles rather than in the
+    # Session's legacy default_* attributes: the driver refuses to mix the
+    # two, and we need more than one profile (see "probe" below).
     profile = ExecutionProfile(
-        load_balancing_policy=RoundRobinPolicy(),
+        # Send requests whose partition key is known to the driver (e.g.,
+        # bound prepared statements) directly to a replica, and fall back to
+        # round-robin for the rest.
+        load_balancing_policy=TokenAwarePolicy(RoundRobinPolicy()),
         consistency_level=ConsistencyLevel.LOCAL_QUORUM,
         serial_consistency_level=ConsistencyLevel.LOCAL_SERIAL,
         # The default timeout (in seconds) for execute() commands is 10, which
@@ -46,37 +67,120 @@ def cql(request):
         # request (e.g., a DROP KEYSPACE needing to drop multiple tables)
         # 10 seconds may not be enough, so let's increase it. See issue #7838.
         request_timeout = 120)
-    if request.config.getoption('ssl'):
+    # The "probe" profile is used by fixtures which read server metadata
+    # (what server is this, which DC, is it alive) from local system tables.
+    # These reads don't need the quorum consistency used by the tests.
+    probe_profile = ExecutionProfile(
+        load_balancing_policy=RoundRobinPolicy(),
+        consistency_level=ConsistencyLevel.ONE,
+        request_timeout = 120)
+    if cql_opts.ssl:
         # Scylla does not support any earlier TLS protocol. If you try,
         # you will get mysterious EOF errors (see issue #6971) :-(
         ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
     else:
         ssl_context = None
-    cluster = Cluster(execution_profiles={EXEC_PROFILE_DEFAULT: profile},
-        contact_points=[request.config.getoption('host')],
-        port=int(request.config.getoption('port')),
+    cluster = Cluster(execution_profiles={EXEC_PROFILE_DEFAULT: profile, 'probe': probe_profile},
+        contact_points=[cql_opts.host],
+        port=cql_opts.port,
         # TODO: make the protocol version an option, to allow testing with
         # different versions. If we drop this setting completely, it will
         # mean pick the latest version supported by the client and the server.
+        # Note that with protocol version 3 and up the driver uses a single
+        # connection per host (or per shard, with Scylla's driver) and
+        # multiplexes requests on it, so there's no pool size to configure.
         protocol_version=4,
         # Use the default superuser credentials, which work for both Scylla and Cassandra
         auth_provider=PlainTextAuthProvider(username='cassandra', password='cassandra'),
         ssl_context=ssl_context,
     )
-    return cluster.connect()
+    # By default, connect() returns as soon as the connection pool to one of
+    # the hosts is ready, while the pools to the other hosts may still be
+    # opening. Wait for all of them, so that the first test doesn't need to.
+    return cluster.connect(wait_for_all_pools=True)
+
+# Remember the outcome of each phase of a test (setup, call, teardown) on
+# the test item, e.g., request.node.rep_call, so fixtures can check in their
+# teardown whether the test itself failed - and if it did, with which
+# exception type (request.node.exctype_call). Only the type is kept, not the
+# traceback, so that the frames of failed tests aren't kept alive until the
+# end of the session.
+@pytest.hookimpl(tryfirst=True, hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    rep = outcome.get_result()
+    setattr(item, "rep_" + rep.when, rep)
+    setattr(item, "exctype_" + rep.when, call.excinfo.type if call.excinfo else None)
+
+# A do-nothing statement used by cql_test_connection below to check that the
+# server is still alive. It is prepared once, so checking it costs just one
+# cheap request.
+@pytest.fixture(scope="session")
+def cql_liveness_probe(cql):
+    return cql.prepare("SELECT key FROM system.local WHERE key = 'local'")
 
 # A function-scoped autouse=True fixture allows us to test after every test
 # that the CQL connection is still alive - and if not report the test which
 # crashed Scylla and stop running any more tests.
+# Sending a request to the server after every test is wasteful, so we only
+# check that the driver session wasn't shut down. A test which failed with
+# an ordinary error already reported the problem, so we don't bother a
+# possibly half-broken server with more requests. Only if the test failed
+# because it lost contact with the server - which is what happens when
+# Scylla crashes in the middle of it - do we send a real request to see if
+# Scylla is still alive.
 @pytest.fixture(scope="function", autouse=True)
-def cql_test_connection(cql, request):
+def cql_test_connection(cql, cql_liveness_probe, request):
     yield
-    try:
-        # We want to run a do-nothing CQL command. "use system" is the
-        # closest to do-nothing I could find...
-        cql.execute("use system")
-    except:
-        pytest.exit(f"Scylla appears to have crashed in test {request.node.parent.name}::{request.node.name}")
+    crashed_msg = f"Scylla appears to have crashed in test {request.node.parent.name}::{request.node.name}"
+    if cql.is_shutdown:
+        pytest.exit(crashed_msg)
+    rep_call = getattr(request.node, "rep_call", None)
+    if rep_call is None or not rep_call.failed:
+        return
+    exctype = request.node.exctype_call
+    if exctype is not None and issubclass(exctype, (NoHostAvailable, OperationTimedOut, ConnectionException)):
+        try:
+            cql.execute(cql_liveness_probe, execution_profile='probe')
+        except:
+            pytest.exit(crashed_msg)
+
+# The "server_caps" fixture learns, once per session, what we need to know
+# about the server we are testing. The fixtures below which check these
+# capabilities (this_dc, is_scylla, scylla_only, cassandra_bug,
+# check_pre_raft) just look at its fields, so they don't need to send any
+# requests of their own.
+@dataclass
+class ServerCaps:
+    # Are we running against Scylla (and not Cassandra)?
+    is_scylla: bool
+    # The name of the DC of the node we are connected to
+    dc: str
+    # Is the raft experimental feature enabled (always false on Cassandra)?
+    raft_on: bool
+
+@pytest.fixture(scope="session")
+def server_caps(cql):
+    # Send all the probes together, and only then wait for them. Each is
+    # sent once, so none of them is prepared - preparing would just add a
+    # blocking round trip to all hosts before the probes are sent.
+    # In Scylla, we check Raft mode by inspecting the configuration via CQL.
+    # system.config only exists in Scylla, so on Cassandra this probe fails -
+    # we only look at its result after we know this is Scylla.
+    tables_future = cql.execute_async("SELECT table_name FROM system_schema.tables WHERE keyspace_name = 'system'", execution_profile='probe')
+    local_future = cql.execute_async("SELECT data_center FROM system.local", execution_profile='probe')
+    config_future = cql.execute_async("SELECT value FROM system.config WHERE name = 'experimental_features'", execution_profile='probe')
+    # We recognize Scylla by checking if there is any system table whose name
+    # starts with the word "scylla" (e.g., system.scylla_local). Only the
+    # table_name column is fetched, and any() stops at the first match.
+    is_scylla = any(row.table_name.startswith('scylla') for row in tables_future.result())
+    dc = local_future.result().one()[0]
+    raft_on = False
+    if is_scylla:
+        # The value is a JSON-formatted list of the enabled feature names.
+        row = config_future.result().one()
+        raft_on = row is not None and 'raft' in json.loads(row.value)
+    return ServerCaps(is_scylla=is_scylla, dc=dc, raft_on=raft_on)
 
 # Until Cassandra 4, NetworkTopologyStrategy did not support the option
 # replication_factor (https://issues.apache.org/jira/browse/CASSANDRA-14303).
@@ -86,8 +190,8 @@ def cql_test_connection(cql, request):
 # a "this_dc" fixture to figure out the name of the current DC, so it can be
 # used in NetworkTopologyStrategy.
 @pytest.fixture(scope="session")
-def this_dc(cql):
-    yield cql.execute("SELECT data_center FROM system.local").one()[0]
+def this_dc(server_caps):
+    return server_caps.dc
 
 # "test_keyspace" fixture: Creates and returns a temporary keyspace to be
 # used in tests that need a keyspace. The keyspace is created with RF=1,
@@ -95,20 +199,29 @@ def this_dc(cql):
 # tests will reuse the same keyspace.
 @pytest.fixture(scope="session")
 def test_keyspace(cql, this_dc):
-    name = unique_name()
-    cql.execute("CREATE KEYSPACE " + name + " WITH REPLICATION = { 'class' : 'NetworkTopologyStrategy', '" + this_dc + "' : 1 }")
+    # unique_name() is only unique within one process, so add the process
+    # id: concurrent pytest processes (e.g., pytest-xdist workers) each have
+    # their own "cql" session and keyspace, and must not pick the same name.
+    name = f"{unique_name()}_{os.getpid()}"
+    # The DC name is a key in the replication map, so it is written as a
+    # CQL string literal, in which a single quote is escaped by doubling it.
+    dc = this_dc.replace("'", "''")
+    cql.execute(f"CREATE KEYSPACE {name} WITH REPLICATION = {{ 'class' : 'NetworkTopologyStrategy', '{dc}' : 1 }}")
     yield name
-    cql.execute("DROP KEYSPACE " + name)
+    cql.execute(f"DROP KEYSPACE {name}")
+
+# The "is_scylla" fixture checks whether we are running against Scylla or
+# Cassandra.
+@pytest.fixture(scope="session")
+def is_scylla(server_caps):
+    return server_caps.is_scylla
 
 # The "scylla_only" fixture can be used by tests for Scylla-only features,
 # which do not exist on Apache Cassandra. A test using this fixture will be
 # skipped if running with "run-cassandra".
 @pytest.fixture(scope="session")
-def scylla_only(cql):
-    # We recognize Scylla by checking if there is any system table whose name
-    # contains the word "scylla":
-    names = [row.table_name for row in cql.execute("SELECT * FROM system_schema.tables WHERE keyspace_name = 'system'")]
-    if not any('scylla' in name for name in names):
+def scylla_only(is_scylla):
+    if not is_scylla:
         pytest.skip('Scylla-only test skipped')
 
 # "cassandra_bug" is similar to "scylla_only", except instead of skipping
@@ -116,11 +229,8 @@ def scylla_only(cql):
 # in rare cases where we consider Scylla's behavior to be the correct one,
 # and Cassandra's to be the bug.
 @pytest.fixture(scope="session")
-def cassandra_bug(cql):
-    # We recognize Scylla by checking if there is any system table whose name
-    # contains the word "scylla":
-    names = [row.table_name for row in cql.execute("SELECT * FROM system_schema.tables WHERE keyspace_name = 'system'")]
-    if not any('scylla' in name for name in names):
+def cassandra_bug(is_scylla):
+    if not is_scylla:
         pytest.xfail('A known Cassandra bug')
 
 # While the raft-based schema modifications are still experimental and only
@@ -130,14 +240,9 @@ def cassandra_bug(cql):
 # should use the "fails_without_raft" fixture. When Raft mode becomes the
 # default, this fixture can be removed.
 @pytest.fixture(scope="session")
-def check_pre_raft(cql):
+def check_pre_raft(server_caps):
     # If not running on Scylla, return false.
-    names = [row.table_name for row in cql.execute("SELECT * FROM system_schema.tables WHERE keyspace_name = 'system'")]
-    if not any('scylla' in name for name in names):
-        return False
-    # In Scylla, we check Raft mode by inspecting the configuration via CQL.
-    experimental_features = list(cql.execute("SELECT value FROM system.config WHERE name = 'experimental_features'"))[0].value
-    return not '"raft"' in experimental_features
+    return server_caps.is_scylla and not server_caps.raft_on
 @pytest.fixture(scope="function")
 def fails_without_raft(request, check_pre_raft):
     if check_pre_raft:
@@ -153,12 +258,19 @@ def fails_without_raft(request, check_pre_raft):
 # 3.25.1, in the following commits:
 # https://github.com/scylladb/python-driver/commit/6ed53d9f7004177e18d9f2ea000a7d159ff9278e,
 # https://github.com/datastax/python-driver/commit/1d9077d3f4c937929acc14f45c7693e76dde39a9
-@pytest.fixture(scope="function")
+# The driver version doesn't change while the tests run, so we check it
+# just once, here. Non-numeric suffixes such as "rc1" in "3.25.0rc1" are
+# ignored.
+_driver_version = tuple(int(m.group()) for m in
+                        (re.match(r'\d+', x) for x in DRIVER_VERSION.split('.')) if m)
+_scylla_driver = 'Scylla' in DRIVER_NAME
+_driver_too_old = (_scylla_driver and _driver_version < (3, 24, 5) or
+                   not _scylla_driver and _driver_version <= (3, 25, 0))
+
+
+@pytest.fixture(scope="session")
 def driver_bug_1():
-    scylla_driver = 'Scylla' in DRIVER_NAME
-    driver_version = tuple(int(x) for x in DRIVER_VERSION.split('.'))
-    if (scylla_driver and driver_version < (3, 24, 5) or
-            not scylla_driver and driver_version <= (3, 25, 0)):
+    if _driver_too_old:
         pytest.skip("Python driver too old to run this test")
 
 # TODO: use new_test_table and "yield from" to make shared test_table
@@ -9,9 +9,12 @@
 
 from cassandra.protocol import InvalidRequest
 from cassandra.cluster import NoHostAvailable
+from cassandra.query import BatchStatement
+from cassandra.concurrent import execute_concurrent, execute_concurrent_with_args
 from util import new_test_table, unique_name, new_function
 
 import pytest
+import functools
 import os.path
 
 # Can be used for marking functions which require
@@ -19,60 +22,123 @@ import os.path
 @pytest.fixture(scope="module")
 def scylla_with_wasm_only(scylla_only, cql, test_keyspace):
     try:
-        f42 = unique_name()
-        f42_body = f'(module(func ${f42} (param $n i64) (result i64)(return i64.const 42))(export "{f42}" (func ${f42})))'
-        res = cql.execute(f"CREATE FUNCTION {test_keyspace}.{f42} (input int) RETURNS NULL ON NULL INPUT RETURNS int LANGUAGE xwasm AS '{f42_body}'")
-        cql.execute(f"DROP FUNCTION {test_keyspace}.{f42}")
+        # The smallest module with an exported function, so that checking
+        # for WASM support costs as little compilation as possible
+        probe = unique_name()
+        probe_body = f'(module (func $n (result i32) i32.const 0) (export "{probe}" (func $n)))'
+        cql.execute(f"CREATE FUNCTION {test_keyspace}.{probe} () RETURNS NULL ON NULL INPUT RETURNS int LANGUAGE xwasm AS '{probe_body}'")
+        cql.execute(f"DROP FUNCTION {test_keyspace}.{probe}")
     except NoHostAvailable as err:
         if "not enabled" in str(err):
             pytest.skip("WASM support was not enabled in Scylla, skipping")
     yield
 
+# All the rows read by the tests below. They are inserted once, in a single
+# batch, by the "table1" fixture instead of row by row by each test.
+table1_rows = [
+    "(p, i) VALUES (10, 10)",
+    "(p) VALUES (14)",
+    "(p) VALUES (9223372036854775807)",
+    "(p) VALUES (3)",
+    "(p) VALUES (7)",
+    "(p) VALUES (997)",
+    "(p, d) VALUES (17, 17.015625)",
+    "(p, f) VALUES (121, 121.00390625)",
+    "(p, bl) VALUES (19, true)",
+    "(p, bl) VALUES (21, false)",
+    "(p, t, t2, s, s2) VALUES (42, 42, 24, 33, 55)",
+    "(p, t, t2, s, s2) VALUES (43, 120, 112, 32000, 24001)",
+    "(p, i, i2) VALUES (777, 1, 2)",
+    "(p, i, i2) VALUES (311, 3, 11)",
+    "(p, i, f, txt) VALUES (700, 7, 7., 'oi')",
+    "(p, txt) VALUES (1000, 'doggo')",
+    "(p, txt) VALUES (1001, 'cat42')",
+    "(p, txt) VALUES (2000, 'doggo')",
+    "(p, txt) VALUES (2001, 'cat42')",
+]
+
 @pytest.fixture(scope="module")
 def table1(cql, test_keyspace):
     table = test_keyspace + "." + unique_name()
     cql.execute("CREATE TABLE " + table +
         "(p bigint PRIMARY KEY, p2 bigint, i int, i2 int, s smallint, s2 smallint, t tinyint, t2 tinyint, d double, f float, bl boolean, txt text)")
+    batch = BatchStatement()
+    for row in table1_rows:
+        batch.add(f"INSERT INTO {table} {row}")
+    cql.execute(batch)
     yield table
     cql.execute("DROP TABLE " + table)
 
+# The functions used by most tests below are all created once, by the
+# module-scoped "wasm_functions" fixture, so Scylla only needs to compile
+# each of them once and the tests just call them. Each function is defined
+# by an entry in wasm_function_defs, mapping a key used by the tests to the
+# function's CQL signature and its source. The function for key "k" is named
+# "wasm_k" - the test keyspace is private to this test run, so a fixed name
+# can't collide with anything. The source is a template in which {name} is
+# replaced by that name, under which the function must be exported.
+wasm_function_defs = {}
+
+@pytest.fixture(scope="module")
+def wasm_functions(cql, test_keyspace, scylla_with_wasm_only):
+    names = {}
+    try:
+        for key, (signature, source) in wasm_function_defs.items():
+            name = f"wasm_{key}"
+            cql.execute(f"CREATE FUNCTION {test_keyspace}.{name} {signature} LANGUAGE xwasm AS '{source.format(name=name)}'")
+            names[key] = f"{test_keyspace}.{name}"
+        yield names
+    finally:
+        for name in names.values():
+            cql.execute(f"DROP FUNCTION {name}")
+
+# The tests read table1 through a few SELECT templates taking the key as a
+# bind marker. prepare() prepares each template only once per module.
+@pytest.fixture(scope="module")
+def prepare(cql):
+    return functools.lru_cache(maxsize=None)(cql.prepare)
+
 # Test that calling a wasm-based fibonacci function works
-def test_fib(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    fib_name = unique_name()
-    fib_source = f"""
+fib_source = """
 (module
-  (func ${fib_name} (param $n i64) (result i64)
-    (if
-      (i64.lt_s (local.get $n) (i64.const 2))
-      (return (local.get $n))
-    )
-    (i64.add
-      (call ${fib_name} (i64.sub (local.get $n) (i64.const 1)))
-      (call ${fib_name} (i64.sub (local.get $n) (i64.const 2)))
+  (func ${name} (param $n i64) (result i64)
+    (local $a i64)
+    (local $b i64)
+    (local $sum i64)
+    (local.set $b (i64.const 1))
+    (block $done
+      (loop $next
+        (br_if $done (i64.le_s (local.get $n) (i64.const 0)))
+        (local.set $sum (i64.add (local.get $a) (local.get $b)))
+        (local.set $a (local.get $b))
+        (local.set $b (local.get $sum))
+        (local.set $n (i64.sub (local.get $n) (i64.const 1)))
+        (br $next)
+      )
     )
+    (local.get $a)
   )
-  (export "{fib_name}" (func ${fib_name}))
+  (export "{name}" (func ${name}))
 )
 """
-    src = f"(input bigint) RETURNS NULL ON NULL INPUT RETURNS bigint LANGUAGE xwasm AS '{fib_source}'"
-    with new_function(cql, test_keyspace, src, fib_name):
-        cql.execute(f"INSERT INTO {table1} (p) VALUES (10)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{fib_name}(p) AS result FROM {table} WHERE p = 10")]
-        assert len(res) == 1 and res[0].result == 55
+wasm_function_defs['fib'] = ("(input bigint) RETURNS NULL ON NULL INPUT RETURNS bigint", fib_source)
 
-        cql.execute(f"INSERT INTO {table} (p) VALUES (14)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{fib_name}(p) AS result FROM {table} WHERE p = 14")]
-        assert len(res) == 1 and res[0].result == 377
+def test_fib(cql, table1, wasm_functions, prepare):
+    fib = wasm_functions['fib']
+    select = prepare(f"SELECT {fib}(p) AS result FROM {table1} WHERE p = ?")
+    select_p2 = prepare(f"SELECT {fib}(p2) AS result FROM {table1} WHERE p = ?")
+    res = [rows.one() for _, rows in execute_concurrent(cql, [
+        (select, [10]), (select, [14]), (select_p2, [14])])]
 
-        # This function returns null on null values
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{fib_name}(p2) AS result FROM {table} WHERE p = 14")]
-        assert len(res) == 1 and res[0].result is None
+    assert res[0].result == 55
+    assert res[1].result == 377
+    # This function returns null on null values
+    assert res[2].result is None
 
-        cql.execute(f"INSERT INTO {table} (p) VALUES (997)")
-        # The call request takes too much time and resources, and should therefore fail
-        with pytest.raises(InvalidRequest, match="wasm"):
-            cql.execute(f"SELECT {test_keyspace}.{fib_name}(p) AS result FROM {table} WHERE p = 997")
+    # The function runs in linear time, but with a huge enough input the
+    # call request takes too much time and resources, and should therefore fail
+    with pytest.raises(InvalidRequest, match="wasm"):
+        cql.execute(select, [9223372036854775807])
 
 # Test that calling a fibonacci function that claims to accept null input works.
 # Note that since the int field is nullable, it's no longer
@@ -85,10 +151,14 @@ def test_fib(cql, test_keyspace, table1, scylla_with_wasm_only):
 # const int WASM_PAGE_SIZE = 64 * 1024;
 # const int _scylla_abi = 0;
 #
-# static long long swap_int64(long long val) {
-#     val = ((val << 8) & 0xFF00FF00FF00FF00ULL ) | ((val >> 8) & 0x00FF00FF00FF00FFULL );
-#     val = ((val << 16) & 0xFFFF0000FFFF0000ULL ) | ((val >> 16) & 0x0000FFFF0000FFFFULL );
-#     return (val << 32) | ((val >> 32) & 0xFFFFFFFFULL);
+# static unsigned long long rotl(unsigned long long val, int n) {
+#     return (val << n) | (val >> (64 - n));
+# }
+#
+# // Each rotation brings two of the bytes into their swapped positions
+# __attribute__((noinline)) static long long swap_int64(long long val) {
+#     return (rotl(val, 8) & 0x000000FF000000FFULL) | (rotl(val, 24) & 0x0000FF000000FF00ULL)
+#          | (rotl(val, 40) & 0x00FF000000FF0000ULL) | (rotl(val, 56) & 0xFF000000FF000000ULL);
 # }
 #
 # long long fib_aux(long long n) {
@@ -115,10 +185,9 @@ def test_fib(cql, test_keyspace, table1, scylla_with_wasm_only):
 # with:
 # $ clang -O2  --target=wasm32 --no-standard-libraries -Wl,--export=fib -Wl,--export=_scylla_abi -Wl,--no-entry fibnull.c -o fibnull.wasm
 # $ wasm2wat fibnull.wasm > fibnull.wat
-def test_fib_called_on_null(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    fib_name = unique_name()
-    fib_source = f"""
+# (the module below was last edited by hand, to match the rotation-based
+# swap_int64 above, which is kept out of line so it appears only once)
+fib_null_source = """
 (module
   (type (;0;) (func (param i64) (result i64)))
   (func (;0;) (type 0) (param i64) (result i64)
@@ -172,93 +241,9 @@ def test_fib_called_on_null(cql, test_keyspace, table1, scylla_with_wasm_only):
       local.get 0
       i32.wrap_i64
       i64.load
-      local.tee 0
-      i64.const 56
-      i64.shl
-      local.get 0
-      i64.const 40
-      i64.shl
-      i64.const 71776119061217280
-      i64.and
-      i64.or
-      local.get 0
-      i64.const 24
-      i64.shl
-      i64.const 280375465082880
-      i64.and
-      local.get 0
-      i64.const 8
-      i64.shl
-      i64.const 1095216660480
-      i64.and
-      i64.or
-      i64.or
-      local.get 0
-      i64.const 8
-      i64.shr_u
-      i64.const 4278190080
-      i64.and
-      local.get 0
-      i64.const 24
-      i64.shr_u
-      i64.const 16711680
-      i64.and
-      i64.or
-      local.get 0
-      i64.const 40
-      i64.shr_u
-      i64.const 65280
-      i64.and
-      local.get 0
-      i64.const 56
-      i64.shr_u
-      i64.or
-      i64.or
-      i64.or
+      call 2
       call 0
-      local.tee 0
-      i64.const 56
-      i64.shl
-      local.get 0
-      i64.const 40
-      i64.shl
-      i64.const 71776119061217280
-      i64.and
-      i64.or
-      local.get 0
-      i64.const 24
-      i64.shl
-      i64.const 280375465082880
-      i64.and
-      local.get 0
-      i64.const 8
-      i64.shl
-      i64.const 1095216660480
-      i64.and
-      i64.or
-      i64.or
-      local.get 0
-      i64.const 8
-      i64.shr_u
-      i64.const 4278190080
-      i64.and
-      local.get 0
-      i64.const 24
-      i64.shr_u
-      i64.const 16711680
-      i64.and
-      i64.or
-      local.get 0
-      i64.const 40
-      i64.shr_u
-      i64.const 65280
-      i64.and
-      local.get 0
-      i64.const 56
-      i64.shr_u
-      i64.or
-      i64.or
-      i64.or
+      call 2
     else
       local.get 2
     end
@@ -267,189 +252,163 @@ def test_fib_called_on_null(cql, test_keyspace, table1, scylla_with_wasm_only):
     i64.extend_i32_u
     i64.const 34359738368
     i64.or)
+  (func (;2;) (type 0) (param i64) (result i64)
+    local.get 0
+    i64.const 8
+    i64.rotl
+    i64.const 1095216660735
+    i64.and
+    local.get 0
+    i64.const 24
+    i64.rotl
+    i64.const 280375465148160
+    i64.and
+    i64.or
+    local.get 0
+    i64.const 40
+    i64.rotl
+    i64.const 71776119077928960
+    i64.and
+    i64.or
+    local.get 0
+    i64.const 56
+    i64.rotl
+    i64.const -72057589759737856
+    i64.and
+    i64.or)
   (memory (;0;) 2)
   (global (;0;) i32 (i32.const 1024))
   (export "memory" (memory 0))
-  (export "{fib_name}" (func 1))
+  (export "{name}" (func 1))
   (export "_scylla_abi" (global 0))
   (data (;0;) (i32.const 1024) "\\01"))
 """
-    src = f"(input bigint) CALLED ON NULL INPUT RETURNS bigint LANGUAGE xwasm AS '{fib_source}'"
-    with new_function(cql, test_keyspace, src, fib_name):
-        cql.execute(f"INSERT INTO {table1} (p) VALUES (3)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{fib_name}(p) AS result FROM {table} WHERE p = 3")]
-        assert len(res) == 1 and res[0].result == 2
+wasm_function_defs['fib_null'] = ("(input bigint) CALLED ON NULL INPUT RETURNS bigint", fib_null_source)
 
-        cql.execute(f"INSERT INTO {table} (p) VALUES (7)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{fib_name}(p) AS result FROM {table} WHERE p = 7")]
-        assert len(res) == 1 and res[0].result == 13
+def test_fib_called_on_null(cql, table1, wasm_functions, prepare):
+    fib = wasm_functions['fib_null']
+    select = prepare(f"SELECT {fib}(p) AS result FROM {table1} WHERE p = ?")
+    select_p2 = prepare(f"SELECT {fib}(p2) AS result FROM {table1} WHERE p = ?")
+    res = [rows.one() for _, rows in execute_concurrent(cql, [
+        (select, [3]), (select, [7]), (select_p2, [7])])]
 
-        # Special semantics defined for null input in our function is to return "42"
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{fib_name}(p2) AS result FROM {table} WHERE p = 7")]
-        assert len(res) == 1 and res[0].result == 42
+    assert res[0].result == 2
+    assert res[1].result == 13
+    # Special semantics defined for null input in our function is to return "42"
+    assert res[2].result == 42
 
-        cql.execute(f"INSERT INTO {table} (p) VALUES (997)")
-        # The call request takes too much time and resources, and should therefore fail
-        with pytest.raises(InvalidRequest, match="wasm"):
-          cql.execute(f"SELECT {test_keyspace}.{fib_name}(p) AS result FROM {table} WHERE p = 997")
+    # The call request takes too much time and resources, and should therefore fail
+    with pytest.raises(InvalidRequest, match="wasm"):
+      cql.execute(select, [997])
 
 # Test that an infinite loop gets broken out of eventually
-def test_infinite_loop(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    inf_loop_name = "inf_loop_" + unique_name()
-    inf_loop_source = f"""
+inf_loop_source = """
 (module
   (type (;0;) (func (param i32) (result i32)))
-  (func ${inf_loop_name} (type 0) (param i32) (result i32)
+  (func ${name} (type 0) (param i32) (result i32)
     loop (result i32)  ;; label = @1
       br 0 (;@1;)
     end)
   (table (;0;) 1 1 funcref)
   (table (;1;) 32 externref)
   (memory (;0;) 17)
-  (export "{inf_loop_name}" (func ${inf_loop_name}))
+  (export "{name}" (func ${name}))
   (elem (;0;) (i32.const 0) func)
   (global (;0;) i32 (i32.const 1024))
   (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 """
-    src = f"(input int) RETURNS NULL ON NULL INPUT RETURNS int LANGUAGE xwasm AS '{inf_loop_source}'"
-    with new_function(cql, test_keyspace, src, inf_loop_name):
-        cql.execute(f"INSERT INTO {table} (p,i) VALUES (10, 10)")
-        import time
-        start = time.monotonic()
-        with pytest.raises(InvalidRequest, match="fuel consumed"):
-            cql.execute(f"SELECT {test_keyspace}.{inf_loop_name}(i) AS result FROM {table} WHERE p = 10")
-        elapsed_s = time.monotonic() - start
-        print(f"Breaking the loop took {elapsed_s*1000:.2f}ms")
+wasm_function_defs['inf_loop'] = ("(input int) RETURNS NULL ON NULL INPUT RETURNS int", inf_loop_source)
+
+def test_infinite_loop(cql, table1, wasm_functions, prepare):
+    inf_loop = wasm_functions['inf_loop']
+    select = prepare(f"SELECT {inf_loop}(i) AS result FROM {table1} WHERE p = ?")
+    with pytest.raises(InvalidRequest, match="fuel consumed"):
+        cql.execute(select, [10])
 
 # Test a wasm function which decreases given double by 1
-def test_f64_param(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    dec_double_name = "dec_double_" + unique_name()
-    dec_double_source = f"""
+dec_double_source = """
 (module
   (type (;0;) (func (param f64) (result f64)))
-  (func ${dec_double_name} (type 0) (param f64) (result f64)
+  (func ${name} (type 0) (param f64) (result f64)
     local.get 0
     f64.const -0x1p+0 (;=-1;)
     f64.add)
   (table (;0;) 1 1 funcref)
   (table (;1;) 32 externref)
   (memory (;0;) 17)
-  (export "{dec_double_name}" (func ${dec_double_name}))
+  (export "{name}" (func ${name}))
   (elem (;0;) (i32.const 0) func)
   (global (;0;) i32 (i32.const 1024))
   (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 """
-    src = f"(input double) RETURNS NULL ON NULL INPUT RETURNS double LANGUAGE xwasm AS '{dec_double_source}'"
-    with new_function(cql, test_keyspace, src, dec_double_name):
-        cql.execute(f"INSERT INTO {table} (p,d) VALUES (17,17.015625)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{dec_double_name}(d) AS result FROM {table} WHERE p = 17")]
-        assert len(res) == 1 and res[0].result == 16.015625
+wasm_function_defs['dec_double'] = ("(input double) RETURNS NULL ON NULL INPUT RETURNS double", dec_double_source)
 
 # Test a wasm function which increases given float by 1
-def test_f32_param(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    inc_float_name = "inc_float_" + unique_name()
-    inc_float_source = f"""
+inc_float_source = """
 (module
   (type (;0;) (func (param f32) (result f32)))
-  (func ${inc_float_name} (type 0) (param f32) (result f32)
+  (func ${name} (type 0) (param f32) (result f32)
     local.get 0
     f32.const 0x1p+0 (;=1;)
     f32.add)
   (table (;0;) 1 1 funcref)
   (table (;1;) 32 externref)
   (memory (;0;) 17)
-  (export "{inc_float_name}" (func ${inc_float_name}))
+  (export "{name}" (func ${name}))
   (elem (;0;) (i32.const 0) func)
   (global (;0;) i32 (i32.const 1024))
   (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 """
-    src = f"(input float) RETURNS NULL ON NULL INPUT RETURNS float LANGUAGE xwasm AS '{inc_float_source}'"
-    with new_function(cql, test_keyspace, src, inc_float_name):
-        cql.execute(f"INSERT INTO {table} (p, f) VALUES (121, 121.00390625)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(f) AS result FROM {table} WHERE p = 121")]
-        assert len(res) == 1 and res[0].result == 122.00390625
+wasm_function_defs['inc_float'] = ("(input float) RETURNS NULL ON NULL INPUT RETURNS float", inc_float_source)
 
 # Test a wasm function which operates on booleans
-def test_bool_negate(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    negate_name = "negate_" + unique_name()
-    negate_source = f"""
+negate_source = """
 (module
   (type (;0;) (func (param i32) (result i32)))
-  (func ${negate_name} (type 0) (param i32) (result i32)
+  (func ${name} (type 0) (param i32) (result i32)
     local.get 0
     i32.eqz)
   (table (;0;) 1 1 funcref)
   (table (;1;) 32 externref)
   (memory (;0;) 17)
-  (export "{negate_name}" (func ${negate_name}))
+  (export "{name}" (func ${name}))
   (elem (;0;) (i32.const 0) func)
   (global (;0;) i32 (i32.const 1024))
   (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 """
-    src = f"(input boolean) RETURNS NULL ON NULL INPUT RETURNS boolean LANGUAGE xwasm AS '{negate_source}'"
-    with new_function(cql, test_keyspace, src, negate_name):
-        cql.execute(f"INSERT INTO {table} (p, bl) VALUES (19, true)")
-        cql.execute(f"INSERT INTO {table} (p, bl) VALUES (21, false)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{negate_name}(bl) AS result FROM {table} WHERE p = 19")]
-        assert len(res) == 1 and res[0].result == False
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{negate_name}(bl) AS result FROM {table} WHERE p = 21")]
-        assert len(res) == 1 and res[0].result == True
+wasm_function_defs['negate'] = ("(input boolean) RETURNS NULL ON NULL INPUT RETURNS boolean", negate_source)
 
 # Test wasm functions which operate on 8bit and 16bit integers,
 # which are simulated by 32bit integers by wasm anyway
-def test_short_ints(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    plus_name = "plus_" + unique_name()
-    plus_source = f"""
+plus_source = """
 (module
   (type (;0;) (func (param i32 i32) (result i32)))
-  (func ${plus_name} (type 0) (param i32 i32) (result i32)
+  (func ${name} (type 0) (param i32 i32) (result i32)
     local.get 1
     local.get 0
     i32.add)
   (table (;0;) 1 1 funcref)
   (table (;1;) 32 externref)
   (memory (;0;) 17)
-  (export "{plus_name}" (func ${plus_name}))
+  (export "{name}" (func ${name}))
   (elem (;0;) (i32.const 0) func)
   (global (;0;) i32 (i32.const 1024))
   (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 """
-    src = f"(input tinyint, input2 tinyint) RETURNS NULL ON NULL INPUT RETURNS tinyint LANGUAGE xwasm AS '{plus_source}'"
-    with new_function(cql, test_keyspace, src, plus_name):
-        cql.execute(f"INSERT INTO {table} (p, t, t2, s, s2) VALUES (42, 42, 24, 33, 55)")
-        cql.execute(f"INSERT INTO {table} (p, t, t2, s, s2) VALUES (43, 120, 112, 32000, 24001)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{plus_name}(t, t2) AS result FROM {table} WHERE p = 42")]
-        assert len(res) == 1 and res[0].result == 66
-        # Overflow is fine
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{plus_name}(t, t2) AS result FROM {table} WHERE p = 43")]
-        assert len(res) == 1 and res[0].result == -24
-    # A similar run for 16bit ints - note that the exact same source code is used
-    src = f"(input smallint, input2 smallint) RETURNS NULL ON NULL INPUT RETURNS smallint LANGUAGE xwasm AS '{plus_source}'"
-    with new_function(cql, test_keyspace, src, plus_name):
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{plus_name}(s, s2) AS result FROM {table} WHERE p = 42")]
-        assert len(res) == 1 and res[0].result == 88
-        # Overflow is fine
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{plus_name}(s, s2) AS result FROM {table} WHERE p = 43")]
-        assert len(res) == 1 and res[0].result == -9535
+wasm_function_defs['plus'] = ("(input tinyint, input2 tinyint) RETURNS NULL ON NULL INPUT RETURNS tinyint", plus_source)
+# A similar function for 16bit ints - note that the exact same source code is used
+wasm_function_defs['plus_smallint'] = ("(input smallint, input2 smallint) RETURNS NULL ON NULL INPUT RETURNS smallint", plus_source)
 
 # Test that passing a large number of params works fine
-def test_9_params(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    sum9_name = "sum9_" + unique_name()
-    sum9_source = f"""
+sum9_source = """
 (module
   (type (;0;) (func (param i32 i32 i32 i32 i32 i32 i32 i32 i32) (result i32)))
-  (func ${sum9_name} (type 0) (param i32 i32 i32 i32 i32 i32 i32 i32 i32) (result i32)
+  (func ${name} (type 0) (param i32 i32 i32 i32 i32 i32 i32 i32 i32) (result i32)
     local.get 1
     local.get 0
     i32.add
@@ -470,27 +429,20 @@ def test_9_params(cql, test_keyspace, table1, scylla_with_wasm_only):
   (table (;0;) 1 1 funcref)
   (table (;1;) 32 externref)
   (memory (;0;) 17)
-  (export "{sum9_name}" (func ${sum9_name}))
+  (export "{name}" (func ${name}))
   (elem (;0;) (i32.const 0) func)
   (global (;0;) i32 (i32.const 1024))
   (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 
 """
-    src = f"(a int, b int, c int, d int, e int, f int, g int, h int, i int) RETURNS NULL ON NULL INPUT RETURNS int LANGUAGE xwasm AS '{sum9_source}'"
-    with new_function(cql, test_keyspace, src, sum9_name):
-        cql.execute(f"INSERT INTO {table} (p, i, i2) VALUES (777, 1,2)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{sum9_name}(i,i2,i2,i,i2,i,i2,i,i2) AS result FROM {table} WHERE p = 777")]
-        assert len(res) == 1 and res[0].result == 14
+wasm_function_defs['sum9'] = ("(a int, b int, c int, d int, e int, f int, g int, h int, i int) RETURNS NULL ON NULL INPUT RETURNS int", sum9_source)
 
 # Test a wasm function which takes 2 arguments - a base and a power - and returns base**power
-def test_pow(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    pow_name = "pow_" + unique_name()
-    pow_source = f"""
+pow_source = """
 (module
   (type (;0;) (func (param i32 i32) (result i32)))
-  (func ${pow_name} (type 0) (param i32 i32) (result i32)
+  (func ${name} (type 0) (param i32 i32) (result i32)
     (local i32 i32)
     i32.const 1
     local.set 2
@@ -540,20 +492,36 @@ def test_pow(cql, test_keyspace, table1, scylla_with_wasm_only):
   (table (;1;) 32 externref)
   (memory (;0;) 17)
   (global (;0;) i32 (i32.const 1024))
-  (export "{pow_name}" (func ${pow_name}))
+  (export "{name}" (func ${name}))
   (elem (;0;) (i32.const 0) func)
   (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 """
-    src = f"(base int, pow int) RETURNS NULL ON NULL INPUT RETURNS int LANGUAGE xwasm AS '{pow_source}'"
-    with new_function(cql, test_keyspace, src, pow_name):
-        cql.execute(f"INSERT INTO {table} (p, i, i2) VALUES (311, 3, 11)")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{pow_name}(i, i2) AS result FROM {table} WHERE p = 311")]
-        assert len(res) == 1 and res[0].result == 177147
+wasm_function_defs['pow'] = ("(base int, pow int) RETURNS NULL ON NULL INPUT RETURNS int", pow_source)
+
+# Call each of the simple functions above on one of the rows of table1
+# and check the single value it returns
+@pytest.mark.parametrize("function,args,p,expected", [
+    ('dec_double', 'd', 17, 16.015625),
+    ('inc_float', 'f', 121, 122.00390625),
+    ('negate', 'bl', 19, False),
+    ('negate', 'bl', 21, True),
+    ('plus', 't, t2', 42, 66),
+    # Overflow is fine
+    ('plus', 't, t2', 43, -24),
+    ('plus_smallint', 's, s2', 42, 88),
+    # Overflow is fine
+    ('plus_smallint', 's, s2', 43, -9535),
+    ('sum9', 'i,i2,i2,i,i2,i,i2,i,i2', 777, 14),
+    ('pow', 'i, i2', 311, 177147),
+])
+def test_simple_function(cql, table1, wasm_functions, prepare, function, args, p, expected):
+    select = prepare(f"SELECT {wasm_functions[function]}({args}) AS result FROM {table1} WHERE p = ?")
+    res = cql.execute(select, [p]).one()
+    assert res.result == expected
 
 # Test that only compilable input is accepted
-def test_compilable(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
+def test_compilable(cql, test_keyspace, scylla_with_wasm_only):
     wrong_source = f"""
 Dear wasmtime compiler, please return a function which returns its float argument increased by 1
 """
@@ -563,8 +531,7 @@ Dear wasmtime compiler, please return a function which returns its float argumen
 
 # Test that not exporting a function with matching name
 # results in an error
-def test_not_exported(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
+def test_not_exported(cql, test_keyspace, scylla_with_wasm_only):
     wrong_source = f"""
 (module
   (type (;0;) (func (param f32) (result f32)))
@@ -582,8 +549,7 @@ def test_not_exported(cql, test_keyspace, table1, scylla_with_wasm_only):
                 f"AS '{wrong_source}'")
 
 # Test that trying to use something that is exported, but is not a function, won't work
-def test_not_a_function(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
+def test_not_a_function(cql, test_keyspace, scylla_with_wasm_only):
     wrong_source = f"""
 (module
   (type (;0;) (func (param f32) (result f32)))
@@ -607,7 +573,6 @@ def test_not_a_function(cql, test_keyspace, table1, scylla_with_wasm_only):
 
 # Test that the function should accept only the correct number and types of params
 def test_validate_params(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
     inc_float_name = "inc_float_" + unique_name()
     inc_float_source = f"""
 (module
@@ -628,19 +593,18 @@ def test_validate_params(cql, test_keyspace, table1, scylla_with_wasm_only):
 """
     src = f"(input int) RETURNS NULL ON NULL INPUT RETURNS float LANGUAGE xwasm AS '{inc_float_source}'"
     with new_function(cql, test_keyspace, src, inc_float_name):
-        cql.execute(f"INSERT INTO {table} (p, i, f, txt) VALUES (700, 7, 7., 'oi')")
         with pytest.raises(InvalidRequest, match="type mismatch"):
-            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(i) AS result FROM {table} WHERE p = 700")
+            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(i) AS result FROM {table1} WHERE p = 700")
     src = f"(input text) RETURNS NULL ON NULL INPUT RETURNS int LANGUAGE xwasm AS '{inc_float_source}'"
     with new_function(cql, test_keyspace, src, inc_float_name):
         with pytest.raises(InvalidRequest, match="failed"):
-            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(txt) AS result FROM {table} WHERE p = 700")
+            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(txt) AS result FROM {table1} WHERE p = 700")
     src = f"(input float) RETURNS NULL ON NULL INPUT RETURNS int LANGUAGE xwasm AS '{inc_float_source}'"
     with new_function(cql, test_keyspace, src, inc_float_name):
         with pytest.raises(InvalidRequest, match="Expected i32, got f32"):
-            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(f) AS result FROM {table} WHERE p = 700")
+            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(f) AS result FROM {table1} WHERE p = 700")
         with pytest.raises(InvalidRequest, match="number.*arguments"):
-            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(i, f) AS result FROM {table} WHERE p = 700")
+            cql.execute(f"SELECT {test_keyspace}.{inc_float_name}(i, f) AS result FROM {table1} WHERE p = 700")
 
 # Test that calling a wasm-based function on a string works.
 # The function doubles the string: dog -> dogdog.
@@ -664,291 +628,104 @@ def test_validate_params(cql, test_keyspace, table1, scylla_with_wasm_only):
 # ... and compiled with
 # clang --target=wasm32 --no-standard-libraries -Wl,--export=dbl -Wl,--export=_scylla_abi -Wl,--no-entry demo.c -o demo.wasm
 # wasm2wat demo.wasm > demo.wat
+# The unoptimized output was then rewritten by hand into the equivalent, much
+# shorter, module below - it keeps its variables in locals instead of on the
+# stack, and copies the string in a single loop.
 
-def test_word_double(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    dbl_name = unique_name()
-    dbl_source = f"""
+dbl_source = """
 (module
   (type (;0;) (func (param i64) (result i64)))
   (func $dbl (type 0) (param i64) (result i64)
-    (local i32 i32 i32 i64 i64 i64 i32 i64 i64 i64 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i32 i64 i64 i64 i64 i64 i32 i32 i64 i64 i64)
-    global.get $__stack_pointer
+    (local i32 i32 i32 i32 i32 i32)
+    memory.size
+    i32.const 16
+    i32.shl
     local.set 1
-    i32.const 48
-    local.set 2
-    local.get 1
-    local.get 2
-    i32.sub
-    local.set 3
-    local.get 3
     local.get 0
-    i64.store offset=40
-    local.get 3
-    i64.load offset=40
-    local.set 4
     i64.const 32
-    local.set 5
-    local.get 4
-    local.get 5
     i64.shr_s
-    local.set 6
-    local.get 6
     i32.wrap_i64
-    local.set 7
-    local.get 3
-    local.get 7
-    i32.store offset=36
-    local.get 3
-    i64.load offset=40
-    local.set 8
-    i64.const 4294967295
-    local.set 9
-    local.get 8
-    local.get 9
-    i64.and
-    local.set 10
-    local.get 10
-    i32.wrap_i64
-    local.set 11
-    local.get 3
-    local.get 11
-    i32.store offset=32
-    memory.size
-    local.set 12
-    i32.const 16
-    local.set 13
-    local.get 12
-    local.get 13
-    i32.shl
-    local.set 14
-    local.get 3
-    local.get 14
-    i32.store offset=28
-    local.get 3
-    i32.load offset=36
-    local.set 15
+    local.tee 2
     i32.const 1
-    local.set 16
-    local.get 15
-    local.get 16
     i32.shl
-    local.set 17
-    i32.const 1
-    local.set 18
-    local.get 17
-    local.get 18
-    i32.sub
-    local.set 19
+    i32.const -1
+    i32.add
     i32.const 65536
-    local.set 20
-    local.get 19
-    local.get 20
     i32.div_s
-    local.set 21
     i32.const 1
-    local.set 22
-    local.get 21
-    local.get 22
     i32.add
-    local.set 23
-    local.get 23
     memory.grow
     drop
-    i32.const 0
-    local.set 24
-    local.get 3
-    local.get 24
-    i32.store offset=24
-    i32.const 0
-    local.set 25
-    local.get 3
-    local.get 25
-    i32.store offset=20
     block  ;; label = @1
+      local.get 2
+      i32.const 1
+      i32.lt_s
+      br_if 0 (;@1;)
+      local.get 0
+      i32.wrap_i64
+      local.set 3
+      local.get 1
+      local.set 4
+      local.get 2
+      local.set 5
       loop  ;; label = @2
-        local.get 3
-        i32.load offset=20
-        local.set 26
-        local.get 3
-        i32.load offset=36
-        local.set 27
-        local.get 26
-        local.set 28
-        local.get 27
-        local.set 29
-        local.get 28
-        local.get 29
-        i32.lt_s
-        local.set 30
-        i32.const 1
-        local.set 31
-        local.get 30
-        local.get 31
-        i32.and
-        local.set 32
-        local.get 32
-        i32.eqz
-        br_if 1 (;@1;)
-        local.get 3
-        i32.load offset=24
-        local.set 33
-        local.get 3
-        i32.load offset=32
-        local.set 34
-        local.get 3
-        i32.load offset=20
-        local.set 35
-        local.get 34
-        local.get 35
+        local.get 4
+        local.get 2
         i32.add
-        local.set 36
-        local.get 33
-        local.get 36
-        i32.add
-        local.set 37
-        local.get 37
-        i32.load8_u
-        local.set 38
-        local.get 3
-        i32.load offset=24
-        local.set 39
-        local.get 3
-        i32.load offset=28
-        local.set 40
+        local.get 4
         local.get 3
-        i32.load offset=20
-        local.set 41
-        local.get 40
-        local.get 41
-        i32.add
-        local.set 42
-        local.get 39
-        local.get 42
-        i32.add
-        local.set 43
-        local.get 43
-        local.get 38
-        i32.store8
-        local.get 3
-        i32.load offset=24
-        local.set 44
-        local.get 3
-        i32.load offset=32
-        local.set 45
-        local.get 3
-        i32.load offset=20
-        local.set 46
-        local.get 45
-        local.get 46
-        i32.add
-        local.set 47
-        local.get 44
-        local.get 47
-        i32.add
-        local.set 48
-        local.get 48
         i32.load8_u
-        local.set 49
-        local.get 3
-        i32.load offset=24
-        local.set 50
-        local.get 3
-        i32.load offset=28
-        local.set 51
-        local.get 3
-        i32.load offset=36
-        local.set 52
-        local.get 51
-        local.get 52
-        i32.add
-        local.set 53
-        local.get 3
-        i32.load offset=20
-        local.set 54
-        local.get 53
-        local.get 54
-        i32.add
-        local.set 55
-        local.get 50
-        local.get 55
-        i32.add
-        local.set 56
-        local.get 56
-        local.get 49
+        local.tee 6
+        i32.store8
+        local.get 6
         i32.store8
         local.get 3
-        i32.load offset=20
-        local.set 57
         i32.const 1
-        local.set 58
-        local.get 57
-        local.get 58
         i32.add
-        local.set 59
-        local.get 3
-        local.get 59
-        i32.store offset=20
-        br 0 (;@2;)
+        local.set 3
+        local.get 4
+        i32.const 1
+        i32.add
+        local.set 4
+        local.get 5
+        i32.const -1
+        i32.add
+        local.tee 5
+        br_if 0 (;@2;)
       end
     end
-    local.get 3
-    i32.load offset=36
-    local.set 60
-    local.get 60
-    local.set 61
-    local.get 61
+    local.get 2
     i64.extend_i32_s
-    local.set 62
-    i64.const 1
-    local.set 63
-    local.get 62
-    local.get 63
+    i64.const 33
     i64.shl
-    local.set 64
-    i64.const 32
-    local.set 65
-    local.get 64
-    local.get 65
-    i64.shl
-    local.set 66
-    local.get 3
-    i32.load offset=28
-    local.set 67
-    local.get 67
-    local.set 68
-    local.get 68
+    local.get 1
     i64.extend_i32_s
-    local.set 69
-    local.get 66
-    local.get 69
-    i64.or
-    local.set 70
-    local.get 3
-    local.get 70
-    i64.store offset=8
-    local.get 3
-    i64.load offset=8
-    local.set 71
-    local.get 71
-    return)
+    i64.or)
   (memory (;0;) 2)
-  (global $__stack_pointer (mut i32) (i32.const 66576))
-  (global (;1;) i32 (i32.const 1024))
+  (global (;0;) i32 (i32.const 1024))
   (export "memory" (memory 0))
-  (export "{dbl_name}" (func $dbl))
-  (export "_scylla_abi" (global 1))
+  (export "{name}" (func $dbl))
+  (export "_scylla_abi" (global 0))
   (data $.rodata (i32.const 1024) "\\01"))
 """
-    src = f"(input text) RETURNS NULL ON NULL INPUT RETURNS text LANGUAGE xwasm AS '{dbl_source}'"
-    with new_function(cql, test_keyspace, src, dbl_name):
-        cql.execute(f"INSERT INTO {table1} (p, txt) VALUES (1000, 'doggo')")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{dbl_name}(txt) AS result FROM {table} WHERE p = 1000")]
-        assert len(res) == 1 and res[0].result == 'doggodoggo'
-
-        cql.execute(f"INSERT INTO {table} (p, txt) VALUES (1001, 'cat42')")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{dbl_name}(txt) AS result FROM {table} WHERE p = 1001")]
-        assert len(res) == 1 and res[0].result == 'cat42cat42'
+wasm_function_defs['dbl'] = ("(input text) RETURNS NULL ON NULL INPUT RETURNS text", dbl_source)
+
+def test_word_double(cql, table1, wasm_functions, prepare):
+    dbl = wasm_functions['dbl']
+    select = prepare(f"SELECT {dbl}(txt) AS result FROM {table1} WHERE p = ?")
+    res = [rows.one() for _, rows in execute_concurrent_with_args(cql, select, [(1000,), (1001,)])]
+    assert res[0].result == 'doggodoggo'
+    assert res[1].result == 'cat42cat42'
+
+# Sources of wasm modules too big to keep in this file are in the
+# test/resource/wasm directory, each exporting its function under the file's
+# base name. wasm_resource_source() reads one, and exports its function under
+# the given name instead. The file is not used as a str.format() template
+# like the sources above, because it may contain braces, e.g., in its data.
+def wasm_resource_source(resource, name):
+    path = os.path.realpath(os.path.join(__file__, f'../../resource/wasm/{resource}.wat'))
+    with open(path, 'r') as f:
+        return f.read().replace(f'export "{resource}"', f'export "{name}"')
 
 # Test that calling a wasm-based function works with ABI version 2.
 # The function returns the input. It's compatible with all data types represented by size + pointer.
@@ -980,13 +757,20 @@ def test_word_double(cql, test_keyspace, table1, scylla_with_wasm_only):
 # cargo build --target=wasm32-wasi --release
 # wasm2wat return_input.wasm > return_input.wat
 
-def test_abi_v2(cql, test_keyspace, table1, scylla_with_wasm_only):
-    table = table1
-    ri_name = unique_name()
-    wat_path = os.path.realpath(os.path.join(__file__, '../../resource/wasm/return_input.wat'))
-    ri_source = open(wat_path, 'r').read().replace('export "return_input"', f'export "{ri_name}"')
-    text_src = f"(input text) RETURNS NULL ON NULL INPUT RETURNS text LANGUAGE xwasm AS '{ri_source}'"
-    with new_function(cql, test_keyspace, text_src, ri_name):
-        cql.execute(f"INSERT INTO {table1} (p, txt) VALUES (2000, 'doggo')")
-        res = [row for row in cql.execute(f"SELECT {test_keyspace}.{ri_name}(txt) AS result FROM {table} WHERE p = 2000")]
-        assert len(res) == 1 and res[0].result == 'doggo'
+# The ABI version 2 function is created by its own module-scoped fixture,
+# rather than by wasm_functions, so that the module is only read and compiled
+# when test_abi_v2 runs, and a server which fails to compile it only fails
+# that test.
+@pytest.fixture(scope="module")
+def abi2_ri_function(cql, test_keyspace, scylla_with_wasm_only):
+    name = "wasm_return_input"
+    source = wasm_resource_source('return_input', name)
+    cql.execute(f"CREATE FUNCTION {test_keyspace}.{name} (input text) RETURNS NULL ON NULL INPUT RETURNS text LANGUAGE xwasm AS '{source}'")
+    yield f"{test_keyspace}.{name}"
+    cql.execute(f"DROP FUNCTION {test_keyspace}.{name}")
+
+@pytest.mark.parametrize("p,txt", [(2000, 'doggo'), (2001, 'cat42')])
+def test_abi_v2(cql, table1, abi2_ri_function, prepare, p, txt):
+    select = prepare(f"SELECT {abi2_ri_function}(txt) AS result FROM {table1} WHERE p = ?")
+    res = cql.execute(select, [p]).one()
+    assert res.result == txt
@@ -16,6 +16,7 @@ Classes:
         Custom tables can be .append()ed.
         A list of tables can be merged with extend().
         drop_table() either random one or a specified one by name.
+        drop_tables() drops several specified ones concurrently.
         drop_all_tables()
         verify_schema() checks expected schema for all managed and active tables.
         .removed_tables keeps previous tables after dropping them.
@@ -31,11 +32,17 @@ Classes:
 from __future__ import annotations
 from abc import ABCMeta
 import asyncio
+import functools
 import itertools
 import logging
 import random
+import sys
 import uuid
-from typing import Optional, Type, List, Set, Union, TYPE_CHECKING
+from typing import Any, Callable, Coroutine, Dict, Iterable, Optional, Type, List, Set, Tuple, Union, \
+                   TYPE_CHECKING
+from cassandra.cluster import EXEC_PROFILE_DEFAULT                       # type: ignore
+from cassandra.query import BatchStatement, BatchType, PreparedStatement  # type: ignore
+from cassandra.query import tuple_factory                                 # type: ignore
 if TYPE_CHECKING:
     from cassandra.cluster import Session as CassandraSession            # type: ignore
 
@@ -48,6 +55,21 @@ class ColumnNotFound(Exception):
     pass
 
 
+async def _run_concurrently(coros: Iterable[Coroutine]) -> None:
+    """Run the given coroutines concurrently and wait for all of them.
+       Uses a task group where available (Python 3.11+), asyncio.gather() otherwise.
+       If any of them fails, raises its exception, as asyncio.gather() does."""
+    if sys.version_info < (3, 11):
+        await asyncio.gather(*coros)
+        return
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for coro in coros:
+                tg.create_task(coro)
+    except BaseExceptionGroup as eg:                                     # type: ignore
+        raise eg.exceptions[0] from None
+
+
 class ValueType(metaclass=ABCMeta):
     """Base value type"""
     name: str = ""
@@ -86,25 +108,38 @@ class UUIDType(ValueType):
         self.name: str = 'uuid'
 
     def val(self, seed: int) -> uuid.UUID:
-        return uuid.UUID(f"{{00000000-0000-0000-0000-{seed:012}}}")
+        # 00000000-0000-0000-0000-<seed as 12 hex digits>
+        assert 0 <= seed < 2**48, f"Seed {seed} does not fit in the last UUID group"
+        return uuid.UUID(int=seed)
+
+
+# Value types are stateless, so all columns of a type share a single instance
+INT_TYPE = IntType()
+TEXT_TYPE = TextType()
+FLOAT_TYPE = FloatType()
+UUID_TYPE = UUIDType()
+_ALL_TYPES = (INT_TYPE, TEXT_TYPE, FLOAT_TYPE, UUID_TYPE)
+_TYPE_INSTANCES = {type(t): t for t in _ALL_TYPES}
 
 
 class Column():
     """A column definition.
        If no value type specified it picks a random one.
        There is no support for collection or user-defined types."""
+    __slots__ = ('name', 'ctype', 'cql', 'val')
+
     def __init__(self, name: str, ctype: Optional[Type[ValueType]] = None):
         self.name: str = name
-        if ctype is not None:
-            self.ctype = ctype()
+        if ctype is None:
+            self.ctype: ValueType = random.choice(_ALL_TYPES)
+        elif ctype in _TYPE_INSTANCES:
+            self.ctype = _TYPE_INSTANCES[ctype]
         else:
-            self.ctype = random.choice([IntType, TextType, FloatType, UUIDType])()
+            self.ctype = ctype()
 
         self.cql: str = f"{self.name} {self.ctype.name}"
-
-    def val(self, seed):
-        """Generate a random value"""
-        return self.ctype.val(seed)
+        # Generate a value from a seed; the type's method, bound once here
+        self.val: Callable[[int], Any] = self.ctype.val
 
     def __str__(self):
         return self.name
@@ -113,6 +148,11 @@ class Column():
 class RandomTable():
     """A managed random table
     """
+    __slots__ = ('id', 'cql', 'keyspace', 'name', 'full_name', 'pks', 'columns', 'removed_columns',
+                 'indexes', 'removed_indexes', '_last_clustering_id', '_last_value_id', '_last_seq',
+                 '_last_idx_id', '_pk_names', '_all_col_names', '_create_cql', '_schema_columns',
+                 '_insert_stmt')
+
     # Sequential unique id
     newid = itertools.count(start=1).__next__
 
@@ -126,8 +166,10 @@ class RandomTable():
         self.keyspace: str = keyspace
         self.name: str = name if name is not None else f"t_{self.id:02}"
         self.full_name: str = keyspace + "." + self.name
-        self.next_clustering_id = itertools.count(start=1).__next__
-        self.next_value_id = itertools.count(start=1).__next__
+        # Last ids given to clustering and value columns, and to indexes
+        self._last_clustering_id: int = 0
+        self._last_value_id: int = 0
+        self._last_idx_id: int = 0
         # TODO: assumes primary key is composed of first self.pks columns
         self.pks = pks
 
@@ -144,24 +186,73 @@ class RandomTable():
                              for i in range(1, ncolumns - pks + 1)]
 
         self.removed_columns: List[Column] = []
-        # Counter for sequential values to insert
-        self.next_seq = itertools.count(start=1).__next__
-        self.next_idx_id = itertools.count(start=1).__next__
+        # Last seed of sequential values inserted
+        self._last_seq: int = 0
         self.indexes: Set[str] = set()
         self.removed_indexes: Set[str] = set()
+        self._pk_names: str = ", ".join(c.name for c in self.columns[:self.pks])
+        self._columns_changed()
+
+    def next_clustering_id(self) -> int:
+        self._last_clustering_id += 1
+        return self._last_clustering_id
+
+    def next_value_id(self) -> int:
+        self._last_value_id += 1
+        return self._last_value_id
+
+    def next_seq(self) -> int:
+        """Get the seed for the next row of sequential values"""
+        self._last_seq += 1
+        return self._last_seq
+
+    def next_idx_id(self) -> int:
+        self._last_idx_id += 1
+        return self._last_idx_id
+
+    def _columns_changed(self) -> None:
+        """Refresh the CQL fragments built from the column list, after it changed"""
+        self._all_col_names: str = ", ".join(c.name for c in self.columns)
+        col_defs = ", ".join(c.cql for c in self.columns)
+        self._create_cql: str = f"CREATE TABLE {self.full_name} ({col_defs}, primary key({self._pk_names}))"
+        # Expected type, kind and position of each column in system_schema.columns, by name
+        self._schema_columns: Dict[str, Tuple[str, str, int]] = {
+            c.name: (c.ctype.name, *self._schema_kind_position(i)) for i, c in enumerate(self.columns)}
+        # INSERT of all columns, prepared again on first use
+        self._insert_stmt: Optional[PreparedStatement] = None
+
+    def _schema_kind_position(self, pos: int) -> Tuple[str, int]:
+        """Get the kind and position in system_schema.columns of the column at position pos"""
+        if pos == 0:
+            return "partition_key", 0
+        elif pos < self.pks:
+            return "clustering", 0
+        else:
+            return "regular", -1
 
     @property
     def all_col_names(self) -> str:
         """Get all column names comma separated for CQL query generation convenience"""
-        return ", ".join([c.name for c in self.columns])
+        return self._all_col_names
+
+    async def insert_stmt(self) -> PreparedStatement:
+        """Get the prepared statement inserting a row with values for all columns.
+           Session.prepare() blocks until all hosts prepared it, so it is run in an executor."""
+        if self._insert_stmt is None:
+            col_names = self.all_col_names
+            stmt = await asyncio.get_running_loop().run_in_executor(
+                    None, self.cql.prepare, f"INSERT INTO {self.full_name} ({col_names}) "
+                                            f"VALUES ({', '.join(['?'] * len(self.columns))})")
+            # Don't cache it if the columns changed while it was being prepared
+            if col_names != self.all_col_names:
+                return await self.insert_stmt()
+            self._insert_stmt = stmt
+        return self._insert_stmt
 
     async def create(self) -> asyncio.Future:
         """Create this table"""
-        col_defs = ", ".join(f"{c.cql}" for c in self.columns)
-        pk_names = ", ".join(c.name for c in self.columns[:self.pks])
-        cql_stmt = f"CREATE TABLE {self.full_name} ({col_defs}, , primary key({pk_names}))"
-        logger.debug(cql_stmt)
-        return await self.cql.run_async(cql_stmt)
+        logger.debug(self._create_cql)
+        return await self.cql.run_async(self._create_cql)
 
     async def drop(self) -> asyncio.Future:
         """Drop this table"""
@@ -177,53 +268,104 @@ class RandomTable():
             ctype = ctype if ctype is not None else TextType
             column = Column(name, ctype=ctype)
         self.columns.append(column)
+        self._columns_changed()
         await self.cql.run_async(f"ALTER TABLE {self.full_name} ADD {column.name} {column.ctype.name}")
 
-    async def drop_column(self, column: Union[Column, str] = None):
+    @functools.singledispatchmethod
+    def _col_to_drop(self, column) -> Column:
+        """Get the column to drop, given by position, by name, or as a Column"""
+        raise AssertionError(f"can not remove unknown type {type(column)}")
+
+    @_col_to_drop.register(int)
+    def _(self, column: int) -> Column:
+        assert column >= self.pks, f"Cannot remove {self.name} PK column at pos {column}"
+        return self.columns[column]
+
+    @_col_to_drop.register(str)
+    def _(self, column: str) -> Column:
+        try:
+            return next(col for col in self.columns if col.name == column)
+        except StopIteration:
+            raise ColumnNotFound(f"Column {column} not found in table {self.name}")
+
+    @_col_to_drop.register(Column)
+    def _(self, column: Column) -> Column:
+        assert column in self.columns, f"column {column.name} not present"
+        return column
+
+    async def drop_column(self, column: Union[Column, str, int] = None):
         if column is None:
-            col = random.choice(self.columns[self.pks:])
-        elif type(column) is int:
-            assert column >= self.pks, f"Cannot remove {self.name} PK column at pos {column}"
-            col = self.columns[column]
-        elif type(column) is str:
-            try:
-                col = next(col for col in self.columns if col.name == column)
-            except StopIteration:
-                raise ColumnNotFound(f"Column {column} not found in table {self.name}")
+            col = self.columns[random.randrange(self.pks, len(self.columns))]
         else:
-            assert type(column) is Column, f"can not remove unknown type {type(column)}"
-            assert column in self.columns, f"column {column.name} not present"
-            col = column
+            col = self._col_to_drop(column)
         assert len(self.columns) - 1 > self.pks, f"Cannot remove last value column {col.name} from {self.name}"
         self.columns.remove(col)
+        self._columns_changed()
         self.removed_columns.append(col)
         await self.cql.run_async(f"ALTER TABLE {self.full_name} DROP {col.name}")
 
     async def insert_seq(self) -> asyncio.Future:
         """Insert a row of next sequential values"""
+        stmt = await self.insert_stmt()
         seed = self.next_seq()
-        return await self.cql.run_async(f"INSERT INTO {self.full_name} ({self.all_col_names}) " +
-                                        f"VALUES ({', '.join(['%s'] * len(self.columns)) })",
-                                        parameters=[c.val(seed) for c in self.columns])
-
-    async def add_index(self, column: Union[Column, str], name: str = None) -> str:
-        if isinstance(column, int):
-            assert column > 0, f"Cannot create secondary index " \
-                               f"on partition key column {self.columns[0].name}"
-            col_name = self.columns[column].name
-        elif isinstance(column, str):
-            col_name = column
-        elif isinstance(column, Column):
-            assert column in self.columns
-            col_name = column.name
-        else:
-            raise TypeError(f"Wrong column type {type(column)} given to add_column")
-
+        return await self.cql.run_async(stmt, [c.val(seed) for c in self.columns])
+
+    async def insert_seq_batch(self, nrows: int, batch_size: int = 100) -> None:
+        """Insert nrows rows of next sequential values, all in the same partition.
+           The partition key takes the value of the first row's seed and the other columns
+           the values of each row's own seed. Rows are sent in UNLOGGED batches of up to
+           batch_size rows, which are cheap for the server as they are single-partition."""
+        assert self.pks > 1, f"Table {self.name} has no clustering key to tell rows apart"
+        assert nrows > 0, f"Number of rows {nrows} must be positive"
+        assert 0 < batch_size <= 100, f"Batch size {batch_size} out of range (1-100)"
+        stmt = await self.insert_stmt()
+        seeds = [self.next_seq() for _ in range(nrows)]
+        pk_val = self.columns[0].val(seeds[0])
+        for start in range(0, nrows, batch_size):
+            batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+            for seed in seeds[start:start + batch_size]:
+                batch.add(stmt, [pk_val] + [c.val(seed) for c in self.columns[1:]])
+            await self.cql.run_async(batch)
+
+    @functools.singledispatchmethod
+    def _index_col_name(self, column) -> str:
+        """Get the name of the column to index, given by position, by name, or as a Column"""
+        raise TypeError(f"Wrong column type {type(column)} given to add_column")
+
+    @_index_col_name.register(int)
+    def _(self, column: int) -> str:
+        assert column > 0, f"Cannot create secondary index " \
+                           f"on partition key column {self.columns[0].name}"
+        return self.columns[column].name
+
+    @_index_col_name.register(str)
+    def _(self, column: str) -> str:
+        return column
+
+    @_index_col_name.register(Column)
+    def _(self, column: Column) -> str:
+        assert column in self.columns
+        return column.name
+
+    async def add_index(self, column: Union[Column, str, int], name: str = None) -> str:
+        col_name = self._index_col_name(column)
         name = name if name is not None else f"{self.name}_{col_name}_{self.next_idx_id():02}"
-        await self.cql.run_async(f"CREATE INDEX {name} on {self.full_name} ({col_name})")
+        await self._create_index(name, col_name)
         self.indexes.add(name)
         return name
 
+    async def add_indexes(self, columns: List[Union[Column, str, int]]) -> List[str]:
+        """Create an index on each of the given columns, concurrently"""
+        col_names = [self._index_col_name(column) for column in columns]
+        names = [f"{self.name}_{col_name}_{self.next_idx_id():02}" for col_name in col_names]
+        await _run_concurrently(self._create_index(name, col_name)
+                                for name, col_name in zip(names, col_names))
+        self.indexes.update(names)
+        return names
+
+    async def _create_index(self, name: str, col_name: str) -> None:
+        await self.cql.run_async(f"CREATE INDEX {name} on {self.full_name} ({col_name})")
+
     async def drop_index(self, name: str) -> None:
         self.indexes.remove(name)
         await self.cql.run_async(f"DROP INDEX {self.keyspace}.{name}")
@@ -241,13 +383,17 @@ class RandomTables():
         self.keyspace = keyspace
         self.tables: List[RandomTable] = []
         self.removed_tables: List[RandomTable] = []
+        # For queries whose rows are just unpacked: returns rows as plain tuples instead of
+        # named tuples. It is passed per request, as the session is shared with the tests.
+        self._tuples_profile = cql.execution_profile_clone_update(EXEC_PROFILE_DEFAULT,
+                                                                  row_factory=tuple_factory)
 
     async def add_tables(self, ntables: int = 1, ncolumns: int = 5) -> None:
         """Add random tables to the list.
         ntables specifies how many tables.
         ncolumns specifies how many random columns per table."""
         tables = [RandomTable(self.cql, self.keyspace, ncolumns) for _ in range(ntables)]
-        await asyncio.gather(*(t.create() for t in tables))
+        await _run_concurrently(t.create() for t in tables)
         self.tables.extend(tables)
 
     async def add_table(self, ncolumns: int = None, columns: List[Column] = None,
@@ -279,10 +425,22 @@ class RandomTables():
         self.removed_tables.append(table)
         return table
 
+    async def drop_tables(self, tables: List[Union[str, RandomTable]]) -> List[RandomTable]:
+        """Drop managed RandomTables by name or by RandomTable instance, concurrently"""
+        by_name = {name: t for t in self.tables for name in (t.name, t.full_name)}
+        to_drop = [by_name[t] if isinstance(t, str) else t for t in tables]
+        for table in to_drop:
+            assert isinstance(table, RandomTable), f"Invalid table type {type(table)}"
+        await _run_concurrently(t.drop() for t in to_drop)
+        self.tables = [t for t in self.tables if t not in to_drop]
+        self.removed_tables.extend(to_drop)
+        return to_drop
+
     async def drop_all_tables(self) -> None:
         """Drop all active managed tables"""
-        await asyncio.gather(*(t.drop() for t in self.tables))
+        await _run_concurrently(t.drop() for t in self.tables)
         self.removed_tables.extend(self.tables)
+        self.tables = []
 
     async def verify_schema(self, table: Union[RandomTable, str] = None) -> None:
         """Verify schema of all active managed random tables"""
@@ -302,34 +460,35 @@ class RandomTables():
                         f"WHERE keyspace_name = '{self.keyspace}'"
 
         logger.debug(cql_stmt1)
-        res1 = {row.table_name for row in await self.cql.run_async(cql_stmt1)}
+        res1 = {table_name for table_name, in await self.cql.run_async(
+                    cql_stmt1, execution_profile=self._tuples_profile)}
         assert not tables - res1, f"Tables {tables - res1} not present"
 
+        if not tables:
+            return
+
+        # Fetch the columns of all the tables at once, and group them by table.
+        # table_name is a clustering column of system_schema.columns, and an IN
+        # restriction on it is limited to 100 values, so several tables are
+        # fetched with the whole keyspace and the other tables skipped here.
+        cql_stmt2 = f"SELECT table_name, column_name, position, kind, type FROM system_schema.columns " \
+                    f"WHERE keyspace_name = '{self.keyspace}'"
+        if len(tables) == 1:
+            cql_stmt2 += f" AND table_name = '{next(iter(tables))}'"
+        logger.debug(cql_stmt2)
+        res2: Dict[str, Dict[str, Tuple[str, str, int]]] = {table_name: {} for table_name in tables}
+        for table_name, c_name, position, kind, c_type in await self.cql.run_async(
+                cql_stmt2, execution_profile=self._tuples_profile):
+            if table_name in res2:
+                res2[table_name][c_name] = (c_type, kind, position)
+
+        by_name = {t.name: t for t in self.tables}
         for table_name in tables:
-            table = next(t for t in self.tables if t.name == table_name)
-            cols = {c.name: c for c in table.columns}
-            c_pos = {c.name: i for i, c in enumerate(table.columns)}
-            cql_stmt2 = f"SELECT column_name, position, kind, type FROM system_schema.columns " \
-                        f"WHERE keyspace_name = '{self.keyspace}' AND table_name = '{table_name}'"
-            logger.debug(cql_stmt2)
-            res2 = {row.column_name: row for row in await self.cql.run_async(cql_stmt2)}
-            assert res2.keys() == cols.keys(), f"Column names for {table_name} do not match " \
-                                               f"expected ({', '.join(cols.keys())}) " \
-                                               f"got ({', '.join(res2.keys())})"
-            for c_name, c in res2.items():
-                pos = c_pos[c_name]
-                col = cols[c_name]
-                assert c.type == col.ctype.name, f"Column {c_name} type does not match " \
-                                                 f"{c.type} {col.ctype.name}"
-                if pos == 0:
-                    kind = "partition_key"
-                    schema_pos = 0
-                elif pos < table.pks:
-                    kind = "clustering"
-                    schema_pos = 0
-                else:
-                    kind = "regular"
-                    schema_pos = -1
-                assert c.kind == kind, f"Column {c_name} kind does not match {c.kind} {kind}"
-                assert c.position == schema_pos, f"Column {c_name} position {c.position} " \
-                                                 f"does not match {schema_pos}"
+            expected = by_name[table_name]._schema_columns
+            got = res2[table_name]
+            assert got.keys() == expected.keys(), f"Column names for {table_name} do not match " \
+                                                  f"expected ({', '.join(expected.keys())}) " \
+                                                  f"got ({', '.join(got.keys())})"
+            assert got == expected, f"Column (type, kind, position) for {table_name} do not match: " + \
+                                    ", ".join(f"{c_name} got {got[c_name]} expected {expected[c_name]}"
+                                              for c_name in got if got[c_name] != expected[c_name])
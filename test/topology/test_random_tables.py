@@ -53,6 +53,16 @@ async def test_new_table_insert_one(cql, random_tables):
     assert list(res[0])[:2] == vals
 
 
+@pytest.mark.asyncio
+async def test_new_table_insert_seq_batch(cql, random_tables):
+    table = await random_tables.add_table(ncolumns=5)
+    # More rows than fit in one batch
+    await table.insert_seq_batch(150)
+    pk_col = table.columns[0]
+    res = await cql.run_async(f"SELECT * FROM {table} WHERE pk=%s", parameters=[pk_col.val(1)])
+    assert len(res) == 150
+
+
 @pytest.mark.asyncio
 async def test_drop_column(cql, random_tables):
     """Drop a random column from a table"""
@@ -77,3 +87,25 @@ async def test_add_index(cql, random_tables):
         await table.add_index(0)
     await table.add_index(2)
     await random_tables.verify_schema(table)
+
+
+@pytest.mark.asyncio
+async def test_drop_tables(cql, random_tables):
+    """Drop several tables at once, by name and by table"""
+    await random_tables.add_tables(ntables=3, ncolumns=5)
+    t0, t1, t2 = random_tables[0], random_tables[1], random_tables[2]
+    await random_tables.drop_tables([t0.name, t1])
+    assert random_tables.tables == [t2]
+    for table in (t0, t1):
+        with pytest.raises(InvalidRequest, match='unconfigured table'):
+            await cql.run_async(f"SELECT * FROM {table}")
+    await random_tables.verify_schema()
+
+
+@pytest.mark.asyncio
+async def test_add_indexes(cql, random_tables):
+    """Add indexes on several columns at once"""
+    table = await random_tables.add_table(ncolumns=5)
+    names = await table.add_indexes([2, table.columns[3]])
+    assert table.indexes == set(names)
+    await random_tables.verify_schema(table)